@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 # coding=UTF-8
 
-__all__ = ["average", "average_images", "directory_average", "nested_directory_average", "results_line", "results_rectangle", "results_save_csv", "results_load_csv"]
+__all__ = ["average", "average_files", "average_images", "directory_average", "nested_directory_average", "results_line", "results_rectangle", "results_save_csv", "results_load_csv", "results_save_binary", "results_load_binary", "Watcher"]
 
 from .average import average
+from .average import average_files
 from .average import average_images
 from .average import directory_average
 from .average import nested_directory_average
@@ -12,6 +13,10 @@ from .loadsave import results_line
 from .loadsave import results_rectangle
 from .loadsave import results_save_csv
 from .loadsave import results_load_csv
+from .loadsave import results_save_binary
+from .loadsave import results_load_binary
+
+from .watch import Watcher
 
 __author__ = 'Rhys Hansen'
 __copyright__ = "Copyright 2017, Rhys Hansen"
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import sys
+
+from .cli import main
+
+sys.exit(main())
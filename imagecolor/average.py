@@ -2,11 +2,22 @@
 # coding=UTF-8
 
 import imghdr
+import inspect
 import logging
+import math
 import os
-from multiprocessing import Pool, cpu_count
+import random
+import signal
+import time
+from contextlib import contextmanager
+from functools import partial
 
 from PIL import Image
+from PIL import UnidentifiedImageError
+
+from .colorspace import pixel_converter
+from .colorspace import to_srgb
+from .colorspace import working_image
 
 """Copyright © 2017 Rhys Hansen
 
@@ -31,8 +42,25 @@ SOFTWARE."""
 logger = logging.getLogger(__name__)
 
 
+IMAGE_TYPES = ['jpeg', 'png']
+IMAGE_FORMATS = ['JPEG', 'PNG']
+SAMPLING_METHODS = ['random', 'stride']
+# two sided 95% confidence
+CONFIDENCE_Z = 1.96
+MIN_SAMPLES = 30
+SAMPLE_BATCH = 32
+JPEG_SCALES = [8, 4, 2, 1]
+MAX_SIZE = 100
+# lab images are downsampled to this many times max_size
+LAB_DETAIL = 4
+SCHEDULES = ['size', 'pixels']
+# seconds past timeout before a task's pool is replaced
+TIMEOUT_GRACE = 1.0
+
+
 def average(image, name=None, downsample=True,
-            max_size=100, alpha_threshold=None):
+            max_size=MAX_SIZE, alpha_threshold=None, tolerance=None,
+            sampling='random', seed=None, colorspace='srgb'):
     """Average a single image.
 
     Averages a single image from a file or file-like object.
@@ -46,55 +74,107 @@ def average(image, name=None, downsample=True,
         downsample : bool, optional
             if downsampling is enabled to speed up iteration.
         max_size : int, optional
-            max length of longest side if downsample == True.
+            max length of longest side if downsample == True. Ignored
+            with a warning when tolerance is set.
         alpha_threshold : int, optional
             level at which transparent pixels are excluded.
+        tolerance : float, optional
+            if set the image is not resized or fully visited. Pixels are
+            sampled until the 95% confidence interval of each channel
+            mean is within +/- tolerance, in the units of colorspace.
+            Must be greater than 0. This trades time for a known error
+            bound on the full resolution image. It is usually slower
+            than the default downsampled average. It is cheaper than
+            downsample=False for JPEG images, which are decoded at a
+            reduced scale when that has enough pixels for the bound.
+            Other formats are decoded in full.
+        sampling : str, optional
+            'random' picks pixels at random, 'stride' visits pixels at a
+            fixed stride through the image. Only used with tolerance.
+        seed : int, optional
+            seed for random sampling.
+        colorspace : str, optional
+            'srgb' averages the encoded values, 'linear' averages linear
+            light (on the 0-255 scale) and 'lab' averages CIELAB (D50).
+            Resizing blends encoded values so linear is always averaged
+            over every pixel, which costs no more than downsampling in
+            linear light would. Lab images are only downsampled to
+            LAB_DETAIL times max_size, which keeps the blending local
+            and the average close to the exact one; set downsample to
+            False for the exact value.
     Returns
     -------
         dict
             A dictionary with the following keys: name, red, green, blue.
+            With tolerance set an error key holds the achieved 95%
+            confidence bound. Outside of srgb the colorspace and the
+            averaged values are added under colorspace and values.
             If the image was unable to be averaged None.
     """
     logger.debug("average called")
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError('sampling must be one of {}'
+                         .format(', '.join(SAMPLING_METHODS)))
+    if tolerance is not None and not tolerance > 0:
+        raise ValueError('tolerance must be greater than 0')
     if alpha_threshold is None:
         alpha_threshold = 245
     if name is None:
         name = image.split(os.sep)[-1]
     logger.debug('Image name: %s', name)
+    if tolerance is not None and max_size != MAX_SIZE:
+        logger.warning('max_size is ignored when tolerance is set')
     try:
-        im = Image.open(image)
+        im = _open_image(image)
         logger.debug('Image opened. Dimensions %d x %d',
                      im.size[0], im.size[1])
-        if ((im.size[0] > max_size or im.size[1] > max_size)
-                and downsample is True):
-            im.thumbnail((max_size, max_size))
-            logger.debug('Image resized to %d x %d', im.size[0], im.size[1])
-        grid = im.load()
-        pixelcount, r_total, g_total, b_total = 0, 0, 0, 0
-        for x in range(im.size[0]):
-            for y in range(im.size[1]):
-                currentpx = grid[x, y]
-                try:
-                    """this try-except checks to see if pixels have
-                    transparency and excludes them if they are greater
-                    than the alpha_threshold (default=245).
-                    """
-                    if currentpx[3] > alpha_threshold:
-                        r_total += currentpx[0]
-                        g_total += currentpx[1]
-                        b_total += currentpx[2]
-                        pixelcount += 1
-                except IndexError:
-                    r_total += currentpx[0]
-                    g_total += currentpx[1]
-                    b_total += currentpx[2]
-                    pixelcount += 1
-        r_avg = int(r_total / pixelcount)
-        g_avg = int(g_total / pixelcount)
-        b_avg = int(b_total / pixelcount)
+        error = None
+        if tolerance is not None:
+            sampled = _sampled_average(image, im, tolerance, sampling,
+                                       alpha_threshold, seed, colorspace)
+            if sampled is None:
+                logger.warning('No opaque pixels sampled in %s', name)
+                return(None)
+            means, error = sampled
+        else:
+            resize = (downsample is True
+                      and (im.size[0] > max_size or im.size[1] > max_size))
+            if resize and colorspace == 'lab' and im.format == 'JPEG':
+                im.draft('RGB', (max_size * LAB_DETAIL,
+                                 max_size * LAB_DETAIL))
+            if im.mode not in ('RGB', 'RGBA'):
+                im = im.convert('RGBA')
+            if resize and colorspace == 'lab':
+                """lab is reduced to LAB_DETAIL times max_size so that
+                encoded values are only blended within small blocks.
+                """
+                factor = max(im.size) // (max_size * LAB_DETAIL)
+                if factor > 1:
+                    im = im.reduce(factor)
+                logger.debug('Image reduced to %d x %d',
+                             im.size[0], im.size[1])
+            if resize and colorspace == 'srgb':
+                im.thumbnail((max_size, max_size))
+                logger.debug('Image resized to %d x %d',
+                             im.size[0], im.size[1])
+            if im.mode == 'RGBA':
+                """pixels with alpha at or below alpha_threshold
+                (default=245) are excluded.
+                """
+                mask = im.getchannel('A').point(
+                    lambda a: 255 if a > alpha_threshold else 0)
+            else:
+                mask = None
+            means = _histogram_average(im, mask, colorspace)
+            if means is None:
+                logger.warning('No opaque pixels in %s', name)
+                return(None)
+        result = _result(name, means, colorspace)
+        if error is not None:
+            result['error'] = error
         logger.debug('average result: Name=%s, R=%d, G=%d, B=%d',
-                     name, r_avg, g_avg, b_avg)
-        return({'name': name, 'red': r_avg, 'green': g_avg, 'blue': b_avg})
+                     name, result['red'], result['green'], result['blue'])
+        return(result)
     except IOError as exc:
         logger.warning('Exception %s', exc)
         logger.debug('average Traceback', exc_info=True)
@@ -102,7 +182,206 @@ def average(image, name=None, downsample=True,
         return None
 
 
-def average_images(dir_in):
+def _open_image(image):
+    """Open image with Pillow, trying the JPEG and PNG plugins first.
+
+    Pillow imports every format plugin the first time it has to look
+    beyond the formats it was given, which is slow to start. Other
+    formats still open, only paying that cost when they are met.
+    """
+    try:
+        return(Image.open(image, formats=IMAGE_FORMATS))
+    except UnidentifiedImageError:
+        if hasattr(image, 'seek'):
+            image.seek(0)
+        return(Image.open(image))
+
+
+def _histogram_average(im, mask, colorspace):
+    """Average every pixel of im under mask from the band histograms.
+
+    Returns None if the mask excludes every pixel.
+    """
+    work, luts = working_image(im, colorspace)
+    histogram = work.histogram(mask)
+    pixelcount = sum(histogram[:256])
+    if pixelcount == 0:
+        return(None)
+    return([sum(count * value for count, value
+                in zip(histogram[band * 256:(band + 1) * 256], luts[band]))
+            / pixelcount for band in range(3)])
+
+
+def _sampled_average(image, im, tolerance, sampling, alpha_threshold,
+                     seed, colorspace):
+    """Estimate the average of an opened image from a sample of pixels.
+
+    The image is only decoded as large as the tolerance needs. A JPEG
+    is first decoded at the smallest DCT scale (1/8 to 1/1) that has as
+    many pixels as the worst case sample, a channel standard deviation
+    of 128, would need. It is decoded again at the next larger scale
+    only if the bound is not met. Other formats are decoded in full.
+    Sampled pixels are converted to colorspace one at a time.
+
+    Returns
+    -------
+        tuple
+            the channel means and the error, or None if every sampled
+            pixel was transparent.
+    """
+    convert = pixel_converter(colorspace)
+    width, height = im.size
+    scales = [1]
+    if im.format == 'JPEG':
+        needed = (CONFIDENCE_Z * 128 / tolerance) ** 2
+        scales = [scale for scale in JPEG_SCALES
+                  if (width // scale) * (height // scale) >= needed] or [1]
+    for attempt, scale in enumerate(scales):
+        if attempt:
+            if hasattr(image, 'seek'):
+                image.seek(0)
+            im = _open_image(image)
+        if scale > 1:
+            im.draft('RGB', (width // scale, height // scale))
+            logger.debug('Decoding at %d x %d', im.size[0], im.size[1])
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA')
+        sampled = _sample_pixels(im, convert, tolerance, sampling,
+                                 alpha_threshold, seed)
+        if sampled is None or sampled[1] <= tolerance:
+            break
+        logger.debug('Error %.2f above tolerance at 1/%d scale',
+                     sampled[1], scale)
+    return(sampled)
+
+
+def _sample_pixels(im, convert, tolerance, sampling, alpha_threshold,
+                   seed=None):
+    """Estimate the average of im from a sample of its pixels.
+
+    Running means and variances are kept with Welford's method and
+    checked every SAMPLE_BATCH pixels once MIN_SAMPLES opaque pixels
+    have been seen. Sampling stops when the widest channel confidence
+    interval is within tolerance. Stride sampling visits each pixel at
+    most once so the error is 0 if it runs through the whole image.
+    """
+    width, height = im.size
+    pixels = width * height
+    grid = im.load()
+    alpha = im.mode == 'RGBA'
+    if sampling == 'stride':
+        step = max(1, int(pixels * 0.6180339887))
+        while math.gcd(step, pixels) != 1:
+            step += 1
+        index = 0
+        draws = pixels
+    else:
+        rng = random.Random(seed)
+        draws = pixels * 4
+    count = 0
+    mean = [0.0, 0.0, 0.0]
+    m2 = [0.0, 0.0, 0.0]
+    error = float('inf')
+    for drawn in range(1, draws + 1):
+        if sampling == 'stride':
+            x, y = index % width, index // width
+            index = (index + step) % pixels
+        else:
+            x, y = rng.randrange(width), rng.randrange(height)
+        currentpx = grid[x, y]
+        if alpha and currentpx[3] <= alpha_threshold:
+            continue
+        count += 1
+        for channel, value in enumerate(convert(currentpx)):
+            delta = value - mean[channel]
+            mean[channel] += delta / count
+            m2[channel] += delta * (value - mean[channel])
+        if count >= MIN_SAMPLES and count % SAMPLE_BATCH == 0:
+            error = CONFIDENCE_Z * math.sqrt(max(m2) / (count - 1) / count)
+            if error <= tolerance:
+                break
+    else:
+        if count == 0:
+            return(None)
+        if sampling == 'stride':
+            error = 0.0
+        elif count > 1:
+            error = CONFIDENCE_Z * math.sqrt(max(m2) / (count - 1) / count)
+    logger.debug('Sampled %d of %d pixels', drawn, pixels)
+    return(mean, error)
+
+
+def _result(name, values, colorspace):
+    """Build a result from channel averages in colorspace.
+
+    sRGB results hold the truncated averages. Other color spaces keep
+    their averages under values and the matching sRGB color.
+    """
+    red, green, blue = to_srgb(values, colorspace)
+    result = {'name': name, 'red': red, 'green': green, 'blue': blue}
+    if colorspace != 'srgb':
+        result['colorspace'] = colorspace
+        result['values'] = list(values)
+    return(result)
+
+
+def average_files(filepaths, processes=None, callback=None, journal=None,
+                  dedupe=False, timeout=None, maxtasksperchild=None,
+                  schedule=None, on_skip=None, **kwargs):
+    """Average a list of image files.
+
+    Averages each file in filepaths and returns a list with an entry
+    for each file in the same order. Files that could not be averaged
+    have an entry of None.
+
+    Parameters
+    ----------
+        filepaths : list
+            paths to image files
+        processes : int, optional
+            number of worker processes. Defaults to the number of CPUs.
+            With 1 the images are averaged in the calling process.
+        callback : callable, optional
+            called as callback(done, total) after each image.
+        journal : str, optional
+            path to a journal file. Images already recorded in it are
+            not averaged again.
+        dedupe : bool, optional
+            if True files with identical content, including hard links,
+            are averaged once and the result reused for each path.
+        timeout : float, optional
+            seconds after which averaging a file is abandoned and the
+            file skipped. The parent process replaces any worker still
+            busy TIMEOUT_GRACE seconds later.
+        maxtasksperchild : int, optional
+            replace each worker process after this many tasks to release
+            memory held by Pillow.
+        schedule : str, optional
+            'size' or 'pixels' to start the largest files first, by file
+            size or by the dimensions in the image header.
+        on_skip : callable, optional
+            called as on_skip(path, reason) for each skipped file.
+        **kwargs
+            passed through to average().
+    Returns
+    -------
+        list
+            For each image averaged returns a list of dictionaries
+            each with the following keys: name, red, green, blue.
+    """
+    journal = _open_journal(journal, kwargs)
+    try:
+        return(_average_files(filepaths, processes, callback, journal,
+                              dedupe, timeout, maxtasksperchild, schedule,
+                              on_skip, **kwargs))
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def average_images(dir_in, processes=None, callback=None, journal=None,
+                   dedupe=False, timeout=None, maxtasksperchild=None,
+                   schedule=None, on_skip=None, **kwargs):
     """Average all images in a directory.
 
     Accepts the path to a directory averages each individual
@@ -113,32 +392,47 @@ def average_images(dir_in):
     ----------
         dir_in : str
             path to directory
+        processes : int, optional
+            number of worker processes. Defaults to the number of CPUs.
+            With 1 the images are averaged in the calling process.
+        callback : callable, optional
+            called as callback(done, total) after each image.
+        journal : str, optional
+            path to a journal file. Images already recorded in it are
+            not averaged again.
+        dedupe : bool, optional
+            if True files with identical content, including hard links,
+            are averaged once and the result reused for each path.
+        timeout : float, optional
+            seconds after which averaging a file is abandoned and the
+            file skipped. The parent process replaces any worker still
+            busy TIMEOUT_GRACE seconds later.
+        maxtasksperchild : int, optional
+            replace each worker process after this many tasks to release
+            memory held by Pillow.
+        schedule : str, optional
+            'size' or 'pixels' to start the largest files first, by file
+            size or by the dimensions in the image header.
+        on_skip : callable, optional
+            called as on_skip(path, reason) for each skipped file.
+        **kwargs
+            passed through to average().
     Returns
     -------
         list
             For each image averaged returns a list of dictionaries
             each with the following keys: name, red, green, blue.
     """
-    try:
-        cpus = cpu_count()
-        logger.debug('Number of CPUs detected. Setting to %d', cpus)
-    except(NotImplementedError):
-        cpus = 4
-        logger.warning('Number of CPUs not found. Setting default to %s', cpus)
-    images = []
-    results = []
-    files = [f for f in os.listdir(dir_in)
-             if os.path.isfile(os.path.join(dir_in, f))]
-    for f in files:
-        filepath = os.path.join(dir_in, f)
-        if imghdr.what(filepath) in ['jpeg', 'png']:
-            images.append(filepath)
-    with Pool(cpus) as p:
-        results = (p.map(average, images))
-    return(results)
+    images = _find_images(dir_in)
+    return(average_files(images, processes, callback, journal, dedupe,
+                         timeout, maxtasksperchild, schedule, on_skip,
+                         **kwargs))
 
 
-def directory_average(dir_in, name=None):
+def directory_average(dir_in, name=None, processes=None,
+                      callback=None, journal=None, dedupe=False,
+                      timeout=None, maxtasksperchild=None, schedule=None,
+                      on_skip=None, **kwargs):
     """Average all images in a directory into a single average.
 
     Averages the images in the directory into a directory average.
@@ -149,94 +443,423 @@ def directory_average(dir_in, name=None):
             path to directory
         name : str, optional
             auto generated from path unless set
+        processes : int, optional
+            number of worker processes. Defaults to the number of CPUs.
+        callback : callable, optional
+            called as callback(done, total) after each image.
+        journal : str, optional
+            path to a journal file. Work already recorded in it is
+            not done again.
+        dedupe : bool, optional
+            if True files with identical content are averaged once.
+        timeout, maxtasksperchild, schedule, on_skip : optional
+            as for average_images.
+        **kwargs
+            passed through to average().
     Returns
     -------
         dict
             A dictionary with the following keys: name, red, green, blue.
             If the image was unable to be averaged None.
     """
-    try:
-        cpus = cpu_count()
-        logger.debug('Number of CPUs detected. Setting to %d', cpus)
-    except(NotImplementedError):
-        cpus = 4
-        logger.warning('Number of CPUs not found. Setting default to %s', cpus)
-    filepaths = []
-    imagecount, r_total, g_total, b_total = 0, 0, 0, 0
     if name is None:
-        dir_name = os.path.normpath(dir_in)
-        dir_name = dir_name.split(os.sep)
-    for filename in os.listdir(dir_in):
-        filepath = os.path.join(dir_in, filename)
-        try:
-            if imghdr.what(filepath) in ['jpeg', 'png']:
-                filepaths.append(filepath)
-        except(IsADirectoryError):
-            logger.debug('Directory %s found, Skipping', filename)
-            pass
-    with Pool(cpus) as p:
-        results = (p.map(average, filepaths))
-    for result in results:
-        try:
-            r_total += result['red']
-            b_total += result['green']
-            g_total += result['blue']
-            imagecount += 1
-        except TypeError:
-            logger.debug('Result not vaild. Skipping', exc_info=True)
-            pass
-        except AttributeError:
-            logger.debug('Result not vaild. Skipping', exc_info=True)
-            pass
-    if imagecount > 0:
-        r_avg = int(r_total / imagecount)
-        g_avg = int(g_total / imagecount)
-        b_avg = int(b_total / imagecount)
-        return({'name': dir_name[-1], 'red': r_avg,
-                'green': g_avg, 'blue': b_avg})
-    else:
-        logger.warning("No images in %s directory successfully averaged. "
-                       "Returning None", dir_name[-1])
-        return(None)
+        name = os.path.normpath(dir_in).split(os.sep)[-1]
+    journal = _open_journal(journal, kwargs)
+    try:
+        dir_totals = _directory_totals(
+            [dir_in], processes, callback, journal, dedupe=dedupe,
+            timeout=timeout, maxtasksperchild=maxtasksperchild,
+            schedule=schedule, on_skip=on_skip, **kwargs)
+    finally:
+        if journal is not None:
+            journal.close()
+    if dir_totals:
+        return(_average_totals(dir_totals[0][1], name,
+                               kwargs.get('colorspace', 'srgb')))
+    logger.warning("No images in %s directory. Returning None", name)
+    return(None)
 
 
-def nested_directory_average(root_dir):
+def nested_directory_average(root_dir, processes=None, callback=None,
+                             journal=None, dedupe=False, timeout=None,
+                             maxtasksperchild=None, schedule=None,
+                             on_skip=None, **kwargs):
     """Recursive directory average.
 
     Accepts the path to a directory and walks all the enclosed
-    directories calling average_directory for each one that
-    contains images.
+    directories averaging each one that contains images. The images
+    from every directory share a single pool of worker processes.
 
     Parameters
     ----------
-        dir_in : str
+        root_dir : str
             path to directory
+        processes : int, optional
+            number of worker processes. Defaults to the number of CPUs.
+        callback : callable, optional
+            called as callback(done, total) after each image.
+        journal : str, optional
+            path to a journal file. Completed images and directories are
+            recorded as they finish. Running again with the same journal
+            skips the recorded work and gives the same results.
+        dedupe : bool, optional
+            if True files with identical content, in any of the
+            directories, are averaged once.
+        timeout, maxtasksperchild, schedule, on_skip : optional
+            as for average_images.
+        **kwargs
+            passed through to average().
     Returns
     -------
         list
             For each directory averaged returns a list of dictionaries
             each with the following keys: name, red, green, blue.
     """
-    filtered_dirs = []
     results = []
     sub_dirs = [d[0] for d in os.walk(root_dir)]
-    for current_dir in sub_dirs:
-        for current_file in os.listdir(current_dir):
-            filepath = os.path.join(current_dir, current_file)
-            try:
-                if imghdr.what(filepath) in ['jpeg', 'png']:
-                    filtered_dirs.append(current_dir)
-                    logger.debug('Image found in directory %s. '
-                                 'Appending to filtered directories',
-                                 current_dir.split(os.sep)[-1])
-                    break
-            except(IsADirectoryError):
-                pass
-    for dir_path in filtered_dirs:
-        result = directory_average(dir_path)
-        try:
-            if result is not None:
-                results.append(result)
-        except TypeError:
-            pass
+    journal = _open_journal(journal, kwargs)
+    try:
+        dir_totals = _directory_totals(
+            sub_dirs, processes, callback, journal, dedupe=dedupe,
+            timeout=timeout, maxtasksperchild=maxtasksperchild,
+            schedule=schedule, on_skip=on_skip, **kwargs)
+    finally:
+        if journal is not None:
+            journal.close()
+    for dir_path, totals in dir_totals:
+        name = os.path.normpath(dir_path).split(os.sep)[-1]
+        result = _average_totals(totals, name,
+                                 kwargs.get('colorspace', 'srgb'))
+        if result is not None:
+            results.append(result)
+    return(results)
+
+
+def _directory_totals(dirs, processes, callback, journal, **kwargs):
+    """Return (dir_path, totals) for each directory containing images.
+
+    The images of all directories are averaged in a single call to
+    _average_files. Directories finished in the journal are not scanned.
+    """
+    filtered_dirs = []
+    filepaths = []
+    for current_dir in dirs:
+        if journal is not None:
+            totals = journal.directory_done(current_dir)
+            if totals is not None:
+                logger.debug('Directory %s found in journal. Skipping',
+                             current_dir.split(os.sep)[-1])
+                filtered_dirs.append((current_dir, [], totals))
+                continue
+        images = _find_images(current_dir)
+        if images:
+            logger.debug('Image found in directory %s. '
+                         'Appending to filtered directories',
+                         current_dir.split(os.sep)[-1])
+            filtered_dirs.append((current_dir, images, None))
+            filepaths.extend(images)
+            if journal is not None:
+                journal.expect(current_dir, images)
+    file_results = _average_files(filepaths, processes, callback, journal,
+                                  **kwargs)
+    dir_totals = []
+    start = 0
+    for dir_path, images, totals in filtered_dirs:
+        if totals is None:
+            totals = _totals(file_results[start:start + len(images)])
+            start += len(images)
+        dir_totals.append((dir_path, totals))
+    return(dir_totals)
+
+
+def _find_images(dir_in):
+    """Return the paths of the jpeg and png files in dir_in."""
+    images = []
+    for filename in os.listdir(dir_in):
+        filepath = os.path.join(dir_in, filename)
+        if not os.path.isfile(filepath):
+            logger.debug('Directory %s found, Skipping', filename)
+            continue
+        if imghdr.what(filepath) in IMAGE_TYPES:
+            images.append(filepath)
+    return(images)
+
+
+def _open_journal(journal, kwargs):
+    """Open a Journal for the path journal, or return None.
+
+    kwargs are the options passed to average(). They are stored in the
+    journal so it is not resumed with different options.
+    """
+    if journal is None:
+        return(None)
+    from .journal import Journal
+    return(Journal(journal, _average_options(kwargs)))
+
+
+def _average_options(kwargs):
+    """Return the average() options in kwargs with the defaults filled in."""
+    options = {name: parameter.default for name, parameter
+               in inspect.signature(average).parameters.items()
+               if name not in ('image', 'name')}
+    options.update(kwargs)
+    return(options)
+
+
+def _process_count(processes=None):
+    """Return the number of worker processes to use."""
+    if processes is not None:
+        return(max(1, int(processes)))
+    cpus = os.cpu_count()
+    if cpus is None:
+        cpus = 4
+        logger.warning('Number of CPUs not found. Setting default to %s', cpus)
+    else:
+        logger.debug('Number of CPUs detected. Setting to %d', cpus)
+    return(cpus)
+
+
+def _average_files(filepaths, processes=None, callback=None, journal=None,
+                   dedupe=False, timeout=None, maxtasksperchild=None,
+                   schedule=None, on_skip=None, **kwargs):
+    """Average a list of files, returning results in the same order.
+
+    multiprocessing is only imported when more than one process is used
+    so that single process callers such as the command line interface
+    start quickly. Files already in the journal are not averaged again
+    and new results are recorded in it as they arrive. With dedupe each
+    distinct file content is averaged once and its result copied to
+    every path with that content. Files that time out or are too large
+    to open are skipped with a None result, reported to on_skip and
+    left out of the journal so a later run retries them.
+    """
+    if schedule is not None and schedule not in SCHEDULES:
+        raise ValueError('schedule must be one of {}'
+                         .format(', '.join(SCHEDULES)))
+    total = len(filepaths)
+    results = [None] * total
+    pending = []
+    for index, filepath in enumerate(filepaths):
+        done = False
+        if journal is not None:
+            done, results[index] = journal.result(filepath)
+        if not done:
+            pending.append(index)
+    done = total - len(pending)
+    if done:
+        logger.info('%d of %d images found in journal', done, total)
+    copies = {}
+    if dedupe:
+        from .dedupe import find_duplicates
+        duplicates = find_duplicates([filepaths[index] for index in pending])
+        for duplicate, original in duplicates.items():
+            copies.setdefault(pending[original], []).append(
+                pending[duplicate])
+        pending = [index for position, index in enumerate(pending)
+                   if position not in duplicates]
+        logger.info('%d duplicate images found', len(duplicates))
+    tasks = [(index, filepaths[index]) for index in pending]
+    if schedule is not None:
+        costs = {index: _task_cost(filepath, schedule)
+                 for index, filepath in tasks}
+        tasks.sort(key=lambda task: costs[task[0]], reverse=True)
+    func = partial(_average_task, timeout=timeout, **kwargs)
+    processes = min(_process_count(processes), len(tasks))
+    pool = None
+    if timeout is not None and tasks:
+        mapped = _supervised_map(func, tasks, processes, maxtasksperchild,
+                                 timeout)
+    elif processes <= 1:
+        mapped = map(func, tasks)
+    else:
+        from multiprocessing import Pool
+        pool = Pool(processes, maxtasksperchild=maxtasksperchild)
+        if schedule is not None:
+            chunksize = 1
+        else:
+            chunksize, extra = divmod(len(tasks), processes * 4)
+            if extra or chunksize == 0:
+                chunksize += 1
+        mapped = pool.imap_unordered(func, tasks, chunksize)
+    try:
+        for index, result, skipped in mapped:
+            if skipped is not None:
+                logger.warning('Skipped %s: %s', filepaths[index], skipped)
+            for copy in [index] + copies.get(index, []):
+                if copy != index and result is not None:
+                    results[copy] = dict(
+                        result, name=filepaths[copy].split(os.sep)[-1])
+                else:
+                    results[copy] = result
+                if skipped is not None:
+                    if on_skip is not None:
+                        on_skip(filepaths[copy], skipped)
+                elif journal is not None:
+                    journal.record_file(filepaths[copy], results[copy])
+                done += 1
+                if callback is not None:
+                    callback(done, total)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        elif hasattr(mapped, 'close'):
+            mapped.close()
     return(results)
+
+
+def _supervised_map(func, tasks, processes, maxtasksperchild, timeout):
+    """Yield func(task) for each task, enforcing timeout from the parent.
+
+    Tasks are submitted with apply_async no more than processes at a
+    time, so each can start as soon as it is submitted, and given
+    timeout plus TIMEOUT_GRACE seconds. SIGALRM in the worker normally
+    ends a slow task well before that. A task still without a result at
+    its deadline, stuck in C code or in a worker that died, is reported
+    as timed out and the pool is terminated and replaced. The other
+    running tasks are submitted again to the new pool.
+    """
+    from multiprocessing import Pool
+    queue = list(reversed(tasks))
+    running = {}
+    pool = Pool(processes, maxtasksperchild=maxtasksperchild)
+    try:
+        while queue or running:
+            while queue and len(running) < processes:
+                task = queue.pop()
+                running[task[0]] = (task, pool.apply_async(func, (task,)),
+                                    time.monotonic() + timeout
+                                    + TIMEOUT_GRACE)
+            ready = [index for index, (_, result, _) in running.items()
+                     if result.ready()]
+            for index in ready:
+                yield(running.pop(index)[1].get())
+            now = time.monotonic()
+            expired = [index for index, (_, _, deadline) in running.items()
+                       if deadline <= now]
+            if expired:
+                logger.warning('Replacing worker pool after %d tasks '
+                               'passed their deadline', len(expired))
+                for index in expired:
+                    del running[index]
+                    yield((index, None,
+                           'timed out after {}s'.format(timeout)))
+                queue.extend(task for task, _, _ in running.values())
+                running.clear()
+                pool.terminate()
+                pool = Pool(processes, maxtasksperchild=maxtasksperchild)
+            elif not ready:
+                earliest = min(deadline for _, _, deadline
+                               in running.values())
+                next(iter(running.values()))[1].wait(
+                    min(0.05, max(0, earliest - now)))
+    finally:
+        pool.terminate()
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _Timeout()
+
+
+@contextmanager
+def _time_limit(seconds):
+    """Raise _Timeout if the block runs for longer than seconds.
+
+    Uses SIGALRM so the limit is only applied on platforms that have it
+    and in the main thread, which is where pool workers run tasks. A
+    long call into Pillow's C code is interrupted when it returns. This
+    is the fast path, _supervised_map enforces the limit otherwise.
+    """
+    if not seconds or not hasattr(signal, 'setitimer'):
+        yield
+        return
+    try:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    except ValueError:
+        logger.debug('Not in the main thread. No time limit applied')
+        yield
+        return
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _average_task(task, timeout=None, **kwargs):
+    """Average one (index, filepath) task in a worker.
+
+    Returns
+    -------
+        tuple
+            the index, the result and the reason the file was skipped
+            or None.
+    """
+    index, filepath = task
+    try:
+        with _time_limit(timeout):
+            return(index, average(filepath, **kwargs), None)
+    except _Timeout:
+        return(index, None, 'timed out after {}s'.format(timeout))
+    except Image.DecompressionBombError as exc:
+        return(index, None, str(exc))
+
+
+def _task_cost(filepath, schedule):
+    """Estimate the work of averaging filepath for largest first order.
+
+    'size' uses the file size and 'pixels' the dimensions in the image
+    header, which Pillow reads without decoding the image.
+    """
+    try:
+        if schedule == 'size':
+            return(os.path.getsize(filepath))
+        with _open_image(filepath) as im:
+            return(im.size[0] * im.size[1])
+    except (IOError, Image.DecompressionBombError):
+        return(0)
+
+
+def _add_result(totals, result, sign=1):
+    """Add a result to totals, a list of count and three channel sums.
+
+    The color space values of a result are summed when it has them,
+    otherwise its red, green and blue. With sign=-1 the result is
+    taken away instead.
+    """
+    try:
+        if 'values' in result:
+            values = result['values']
+        else:
+            values = result['red'], result['green'], result['blue']
+    except TypeError:
+        logger.debug('Result not vaild. Skipping', exc_info=True)
+        return
+    totals[0] += sign
+    totals[1] += sign * values[0]
+    totals[2] += sign * values[1]
+    totals[3] += sign * values[2]
+
+
+def _totals(results):
+    """Return the count and channel totals of results."""
+    totals = [0, 0, 0, 0]
+    for result in results:
+        _add_result(totals, result)
+    return(totals)
+
+
+def _average_totals(totals, name, colorspace='srgb'):
+    """Average totals in colorspace into a single result named name."""
+    imagecount = totals[0]
+    if imagecount > 0:
+        return(_result(name, [t / imagecount for t in totals[1:]],
+                       colorspace))
+    else:
+        logger.warning("No images in %s directory successfully averaged. "
+                       "Returning None", name)
+        return(None)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import argparse
+import logging
+import sys
+import time
+
+from .average import average_files
+from .average import average_images
+from .average import directory_average
+from .average import nested_directory_average
+from .average import SAMPLING_METHODS
+from .average import SCHEDULES
+from .colorspace import COLORSPACES
+from .loadsave import results_line
+from .loadsave import results_rectangle
+from .loadsave import results_save_binary
+from .loadsave import results_save_csv
+
+"""Copyright © 2017 Rhys Hansen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE."""
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ['csv', 'binary', 'line', 'rectangle']
+# results_rectangle needs a whole 3x2 block of results
+RECTANGLE_MIN = 3 * 2
+
+
+class Progress(object):
+    """Write a throughput and ETA status line to a stream.
+
+    Instances are passed as the callback of the averaging functions.
+    The line is redrawn at most every interval seconds.
+    """
+
+    def __init__(self, stream=None, interval=0.1):
+        self.stream = sys.stderr if stream is None else stream
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last = 0
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if done < total and now - self.last < self.interval:
+            return
+        self.last = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0
+        if rate > 0:
+            eta = int((total - done) / rate)
+            eta = '{}:{:02d}'.format(eta // 60, eta % 60)
+        else:
+            eta = '-:--'
+        self.stream.write('\r{}/{} images  {:.1f} images/s  ETA {}'
+                          .format(done, total, rate, eta))
+        if done == total:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+def _positive_float(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError('must be greater than 0')
+    return(number)
+
+
+def build_parser():
+    """Create the argument parser for the imagecolor command."""
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument('-j', '--jobs', type=int, default=None,
+                         help='number of worker processes '
+                              '(default: number of CPUs)')
+    options.add_argument('-s', '--max-size', type=int, default=100,
+                         help='downsample images so the longest side is '
+                              'at most this many pixels (default: 100)')
+    options.add_argument('--no-downsample', action='store_true',
+                         help='average every pixel of the full image')
+    options.add_argument('-a', '--alpha-threshold', type=int, default=None,
+                         help='exclude pixels with alpha at or below this '
+                              'level (default: 245)')
+    options.add_argument('-c', '--colorspace', choices=COLORSPACES,
+                         default='srgb',
+                         help='color space to average in (default: srgb)')
+    options.add_argument('-t', '--tolerance', type=_positive_float,
+                         default=None,
+                         help='sample pixels until each channel mean is '
+                              'known within this many levels (95%% '
+                              'confidence) instead of averaging every pixel')
+    options.add_argument('--sampling', choices=SAMPLING_METHODS,
+                         default='random',
+                         help='pixel sampling method used with --tolerance '
+                              '(default: random)')
+    options.add_argument('-f', '--format', choices=FORMATS, default='csv',
+                         help='output format (default: csv)')
+    options.add_argument('-o', '--output', default='-',
+                         help='output file (default: stdout). line and '
+                              'rectangle images are always written as PNG')
+    options.add_argument('--journal', default=None, metavar='PATH',
+                         help='record finished work in PATH and skip work '
+                              'already recorded there')
+    options.add_argument('--dedupe', action='store_true',
+                         help='average identical files only once')
+    options.add_argument('--timeout', type=float, default=None,
+                         metavar='SECONDS',
+                         help='skip files that take longer than this')
+    options.add_argument('--maxtasksperchild', type=int, default=None,
+                         metavar='N',
+                         help='replace worker processes after N tasks')
+    options.add_argument('--schedule', choices=SCHEDULES, default=None,
+                         help='start the largest files first, by file size '
+                              'or by pixel count')
+    options.add_argument('-q', '--quiet', action='store_true',
+                         help='do not show progress')
+    options.add_argument('-v', '--verbose', action='count', default=0,
+                         help='log more detail, repeat for debug output')
+    parser = argparse.ArgumentParser(
+        prog='imagecolor', description='Extract average colors from images.')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+    command = commands.add_parser(
+        'average', parents=[options], help='average image files')
+    command.add_argument('paths', nargs='+', metavar='IMAGE')
+    for name, help_text in [
+            ('average-images', 'average each image in a directory'),
+            ('directory-average', 'average a directory into one color'),
+            ('nested-directory-average',
+             'average each directory below a directory')]:
+        command = commands.add_parser(name, parents=[options], help=help_text)
+        command.add_argument('path', metavar='DIRECTORY')
+    return(parser)
+
+
+def run(args, callback=None, on_skip=None):
+    """Run the command described by args and return a list of results."""
+    kwargs = {'processes': args.jobs,
+              'callback': callback,
+              'on_skip': on_skip,
+              'timeout': args.timeout,
+              'maxtasksperchild': args.maxtasksperchild,
+              'schedule': args.schedule,
+              'downsample': not args.no_downsample,
+              'max_size': args.max_size,
+              'alpha_threshold': args.alpha_threshold,
+              'tolerance': args.tolerance,
+              'sampling': args.sampling,
+              'colorspace': args.colorspace,
+              'dedupe': args.dedupe,
+              'journal': args.journal}
+    if args.command == 'average':
+        results = average_files(args.paths, **kwargs)
+    elif args.command == 'average-images':
+        results = average_images(args.path, **kwargs)
+    elif args.command == 'directory-average':
+        results = [directory_average(args.path, **kwargs)]
+    else:
+        results = nested_directory_average(args.path, **kwargs)
+    return([r for r in results if r is not None])
+
+
+def write_results(results, output_format, output):
+    """Write results to output in output_format. '-' is stdout."""
+    if output_format == 'csv':
+        if output == '-':
+            results_save_csv(results, sys.stdout)
+        else:
+            results_save_csv(results, output)
+        return
+    if output == '-':
+        output = sys.stdout.buffer
+    if output_format == 'binary':
+        results_save_binary(results, output)
+        return
+    if output_format == 'line':
+        im = results_line(results)
+    else:
+        im = results_rectangle(results)
+    if im is not None:
+        im.save(output, format='PNG')
+
+
+def main(argv=None):
+    """Entry point for the imagecolor command."""
+    args = build_parser().parse_args(argv)
+    level = [logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose,
+                                                               2)]
+    logging.basicConfig(level=level,
+                        format='%(name)s %(levelname)s: %(message)s')
+    callback = None
+    if not args.quiet and sys.stderr.isatty():
+        callback = Progress()
+    skipped = []
+    results = run(args, callback,
+                  on_skip=lambda path, reason: skipped.append(path))
+    if skipped:
+        logger.warning('%d files skipped', len(skipped))
+    if not results:
+        logger.error('No images averaged')
+        return(1)
+    if args.format == 'rectangle' and len(results) < RECTANGLE_MIN:
+        logger.error('rectangle output needs at least %d results, not %d. '
+                     'Use -f line instead', RECTANGLE_MIN, len(results))
+        return(1)
+    write_results(results, args.format, args.output)
+    return(0)
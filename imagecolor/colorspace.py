@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import logging
+
+"""Copyright © 2017 Rhys Hansen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE."""
+
+logger = logging.getLogger(__name__)
+
+COLORSPACES = ['srgb', 'linear', 'lab']
+VALUE_NAMES = {'linear': ['Linear Red', 'Linear Green', 'Linear Blue'],
+               'lab': ['L*', 'a*', 'b*']}
+
+# CIE D50, the white point of the ICC profile connection space used
+# by Pillow's LAB mode.
+WHITE_D50 = (0.96422, 1.0, 0.82521)
+# linear sRGB to XYZ (D50, Bradford adapted)
+LINEAR_TO_XYZ_D50 = ((0.4360747, 0.3850649, 0.1430804),
+                     (0.2225045, 0.7168786, 0.0606169),
+                     (0.0139322, 0.0971045, 0.7141733))
+# XYZ (D50, Bradford adapted) to linear sRGB
+XYZ_D50_TO_LINEAR = ((3.1338561, -1.6168667, -0.4906146),
+                     (-0.9787684, 1.9161415, 0.0334540),
+                     (0.0719453, -0.2289914, 1.4052427))
+
+
+def _srgb_to_linear(value):
+    value = value / 255
+    if value <= 0.04045:
+        return(value / 12.92)
+    return(((value + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(value):
+    if value <= 0.0031308:
+        return(value * 12.92)
+    return(1.055 * value ** (1 / 2.4) - 0.055)
+
+
+# Lookup tables from an 8 bit channel value to the value averaged.
+# Linear light is kept on the 0-255 scale of the sRGB levels.
+IDENTITY_LUT = list(range(256))
+SRGB_TO_LINEAR_LUT = [255 * _srgb_to_linear(v) for v in range(256)]
+LAB_L_LUT = [v * 100 / 255 for v in range(256)]
+LAB_AB_LUT = [v - 128 for v in range(256)]
+
+
+def _to_byte(value):
+    return(min(255, max(0, int(value * 255 + 0.5))))
+
+
+def linear_to_srgb(values):
+    """Convert linear light values on the 0-255 scale to sRGB levels."""
+    return(tuple(_to_byte(_linear_to_srgb(max(0, v) / 255))
+                 for v in values))
+
+
+def lab_to_srgb(values):
+    """Convert a D50 CIELAB color to sRGB levels."""
+    lightness, a, b = values
+    fy = (lightness + 16) / 116
+    fx = fy + a / 500
+    fz = fy - b / 200
+    xyz = []
+    for f, white in zip((fx, fy, fz), WHITE_D50):
+        if f > 6 / 29:
+            xyz.append(white * f ** 3)
+        else:
+            xyz.append(white * 3 * (6 / 29) ** 2 * (f - 4 / 29))
+    linear = [sum(m * c for m, c in zip(row, xyz))
+              for row in XYZ_D50_TO_LINEAR]
+    return(tuple(_to_byte(_linear_to_srgb(min(1, max(0, v))))
+                 for v in linear))
+
+
+def _lab_f(t):
+    if t > (6 / 29) ** 3:
+        return(t ** (1 / 3))
+    return(t / (3 * (6 / 29) ** 2) + 4 / 29)
+
+
+def linear_to_lab(values):
+    """Convert linear light values on the 0-255 scale to D50 CIELAB."""
+    linear = [v / 255 for v in values]
+    fx, fy, fz = (_lab_f(sum(m * c for m, c in zip(row, linear)) / white)
+                  for row, white in zip(LINEAR_TO_XYZ_D50, WHITE_D50))
+    return((116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)))
+
+
+def pixel_converter(colorspace):
+    """Return a function from an RGB or RGBA pixel to its values.
+
+    Used where only some pixels are read, such as sampling, so that
+    the whole image does not have to be converted.
+    """
+    _check(colorspace)
+    if colorspace == 'srgb':
+        return(lambda pixel: pixel[:3])
+    lut = SRGB_TO_LINEAR_LUT
+    if colorspace == 'linear':
+        return(lambda pixel: (lut[pixel[0]], lut[pixel[1]], lut[pixel[2]]))
+    return(lambda pixel: linear_to_lab((lut[pixel[0]], lut[pixel[1]],
+                                        lut[pixel[2]])))
+
+
+def _check(colorspace):
+    if colorspace not in COLORSPACES:
+        raise ValueError('colorspace must be one of {}'
+                         .format(', '.join(COLORSPACES)))
+
+
+def to_srgb(values, colorspace):
+    """Convert averaged values in colorspace to sRGB levels."""
+    if colorspace == 'linear':
+        return(linear_to_srgb(values))
+    if colorspace == 'lab':
+        return(lab_to_srgb(values))
+    return(tuple(int(v) for v in values))
+
+
+def working_image(im, colorspace):
+    """Prepare an RGB or RGBA image for averaging in colorspace.
+
+    Returns a three band image and a lookup table for each band mapping
+    its 8 bit values to the values that are averaged. Lab images are
+    converted with littlecms so no per pixel work happens in Python.
+    """
+    _check(colorspace)
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    if colorspace == 'srgb':
+        return(im, [IDENTITY_LUT] * 3)
+    if colorspace == 'linear':
+        return(im, [SRGB_TO_LINEAR_LUT] * 3)
+    return(_srgb_to_lab(im), [LAB_L_LUT, LAB_AB_LUT, LAB_AB_LUT])
+
+
+_lab_transform = None
+
+
+def _srgb_to_lab(im):
+    """Convert an RGB image to a Pillow LAB image.
+
+    ImageCms is imported and the transform built on first use only.
+    """
+    global _lab_transform
+    from PIL import ImageCms
+    if _lab_transform is None:
+        _lab_transform = ImageCms.buildTransform(
+            ImageCms.createProfile('sRGB'), ImageCms.createProfile('LAB'),
+            'RGB', 'LAB')
+    return(ImageCms.applyTransform(im, _lab_transform))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import hashlib
+import logging
+import os
+
+"""Copyright © 2017 Rhys Hansen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE."""
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_SIZE = 64 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+def find_duplicates(filepaths):
+    """Find files with the same content.
+
+    Files are compared as cheaply as possible. Paths to the same inode
+    (hard links) are duplicates without reading them. Other files are
+    only read if another file has the same size, then only their first
+    and last PARTIAL_SIZE bytes are hashed. Files larger than that are
+    fully hashed only if their partial hashes match.
+
+    Parameters
+    ----------
+        filepaths : list
+            paths to files
+    Returns
+    -------
+        dict
+            maps the index of each duplicate in filepaths to the index
+            of the first file with the same content.
+    """
+    duplicates = {}
+    inodes = {}
+    sizes = {}
+    for index, filepath in enumerate(filepaths):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            logger.debug('Unable to stat %s', filepath, exc_info=True)
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in inodes:
+            duplicates[index] = inodes[inode]
+            continue
+        inodes[inode] = index
+        sizes.setdefault(stat.st_size, []).append(index)
+    for size, indexes in sizes.items():
+        if len(indexes) < 2:
+            continue
+        partial = _group(filepaths, indexes, _partial_hash)
+        for group in partial:
+            if size > 2 * PARTIAL_SIZE:
+                groups = _group(filepaths, group, _full_hash)
+            else:
+                groups = [group]
+            for same in groups:
+                for index in same[1:]:
+                    duplicates[index] = same[0]
+    logger.debug('%d of %d files are duplicates',
+                 len(duplicates), len(filepaths))
+    return(duplicates)
+
+
+def _group(filepaths, indexes, hash_file):
+    """Split indexes into groups of two or more files with equal hashes."""
+    hashes = {}
+    for index in indexes:
+        try:
+            digest = hash_file(filepaths[index])
+        except OSError:
+            logger.debug('Unable to read %s', filepaths[index],
+                         exc_info=True)
+            continue
+        hashes.setdefault(digest, []).append(index)
+    return([group for group in hashes.values() if len(group) > 1])
+
+
+def _partial_hash(filepath):
+    """Hash the first and last PARTIAL_SIZE bytes of filepath."""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        digest.update(f.read(PARTIAL_SIZE))
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        if end > PARTIAL_SIZE:
+            f.seek(max(PARTIAL_SIZE, end - PARTIAL_SIZE))
+            digest.update(f.read(PARTIAL_SIZE))
+    return(digest.digest())
+
+
+def _full_hash(filepath):
+    """Hash all of filepath."""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return(digest.digest())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import json
+import logging
+import os
+import time
+
+from .average import _totals
+
+"""Copyright © 2017 Rhys Hansen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE."""
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+    """Append only record of completed work for resumable runs.
+
+    Each line of the journal file is a JSON object. The first line
+    records the options the images are averaged with. File lines record
+    the result of averaging one image and directory lines record the
+    image count and color totals of a directory once all of its images
+    are done. Opening an existing journal loads those records so that
+    a restarted run can skip the work they describe. A torn last line
+    left by a crash is cut off.
+
+    Parameters
+    ----------
+        path : str
+            path to the journal file. Created if it does not exist.
+        options : dict, optional
+            the options passed to average(). An existing journal written
+            with different options raises ValueError rather than mixing
+            results averaged in different ways.
+        sync_interval : float, optional
+            seconds between flushing and fsyncing the journal.
+    """
+
+    def __init__(self, path, options=None, sync_interval=5.0):
+        self.path = path
+        self.options = json.loads(json.dumps(options))
+        self.sync_interval = sync_interval
+        self.files = {}
+        self.directories = {}
+        self._pending = {}
+        self._file_dirs = {}
+        self._last_sync = time.monotonic()
+        records = read_records(path)
+        if records:
+            self._load(records)
+        self._f = open(path, 'a')
+        if not records:
+            self._write({'options': self.options})
+
+    def _load(self, records):
+        logger.info('Loading journal %s', self.path)
+        header = records[0].get('options') if 'options' in records[0] else {}
+        if self.options is not None and header != self.options:
+            raise ValueError('journal {} was written with the options {} '
+                             'not {}'.format(self.path, header,
+                                             self.options))
+        for record in records:
+            if 'file' in record:
+                self.files[record['file']] = record['result']
+            elif 'directory' in record:
+                self.directories[record['directory']] = record['totals']
+        logger.info('Journal has %d files and %d directories done',
+                    len(self.files), len(self.directories))
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def expect(self, dir_path, filepaths):
+        """Register the images of a directory that is about to be run.
+
+        Once all of its images are recorded the directory totals are
+        written to the journal, summed in the order of filepaths so that
+        they match the totals of a run without a journal exactly.
+        """
+        dir_path = os.path.abspath(dir_path)
+        filepaths = [os.path.abspath(filepath) for filepath in filepaths]
+        remaining = set(filepath for filepath in filepaths
+                        if filepath not in self.files)
+        for filepath in remaining:
+            self._file_dirs[filepath] = dir_path
+        self._pending[dir_path] = (filepaths, remaining)
+        if not remaining:
+            self._finish_directory(dir_path)
+
+    def directory_done(self, dir_path):
+        """Return the totals of a finished directory or None."""
+        return(self.directories.get(os.path.abspath(dir_path)))
+
+    def result(self, filepath):
+        """Return (True, result) for a finished file or (False, None)."""
+        filepath = os.path.abspath(filepath)
+        if filepath in self.files:
+            return(True, self.files[filepath])
+        return(False, None)
+
+    def record_file(self, filepath, result):
+        """Record the result of averaging filepath."""
+        filepath = os.path.abspath(filepath)
+        self.files[filepath] = result
+        self._write({'file': filepath, 'result': result})
+        dir_path = self._file_dirs.pop(filepath, None)
+        if dir_path in self._pending:
+            remaining = self._pending[dir_path][1]
+            remaining.discard(filepath)
+            if not remaining:
+                self._finish_directory(dir_path)
+        self._maybe_sync()
+
+    def _finish_directory(self, dir_path):
+        filepaths, _ = self._pending.pop(dir_path)
+        totals = _totals(self.files[filepath] for filepath in filepaths)
+        self.directories[dir_path] = totals
+        self._write({'directory': dir_path, 'totals': totals})
+
+    def _write(self, record):
+        self._f.write(json.dumps(record) + '\n')
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Flush the journal and fsync it to disk."""
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Sync and close the journal file."""
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+
+def read_records(path):
+    """Read the JSON lines of path, cutting off a torn last line.
+
+    A crash while appending can leave a last line without its newline.
+    The file is truncated to its last complete line so that the next
+    append starts on a line of its own. Other damaged lines are skipped.
+
+    Returns
+    -------
+        list
+            the records in the file, empty if it does not exist.
+    """
+    if not os.path.exists(path):
+        return([])
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            logger.warning('Cutting torn last line from %s', path)
+            f.truncate(end)
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            logger.warning('Ignoring damaged line in %s', path)
+    return(records)
@@ -4,9 +4,13 @@ import csv
 import logging
 import math
 import os
+import struct
 
 from PIL import Image
 
+from .colorspace import COLORSPACES
+from .colorspace import VALUE_NAMES
+
 """Copyright © 2017 Rhys Hansen
 
 Permission is hereby granted, free of charge, to any person obtaining a copy
@@ -29,6 +33,9 @@ SOFTWARE."""
 
 logger = logging.getLogger(__name__)
 
+BINARY_MAGIC = b'ICR1'
+BINARY_VALUES_MAGIC = b'ICR2'
+
 
 def results_line(results):
     """Create a line of pixels from a list of results.
@@ -108,26 +115,47 @@ def results_save_csv(results, csv_out):
     be re-loaded again by using csv_to_results. The csv created
     is formatted as follows:
     'File or Folder', 'Red', 'Green', 'Blue'
+    Results averaged in a linear or lab colorspace have three more
+    columns holding their values, named after the colorspace.
 
     Parameters
     ----------
         results : list
             a list of imagecolor results
         csv_out : str
-            the path to the file to be created
+            the path to the file to be created or a text file object
     """
     if len(results) == 0:
         logger.error("Nothing in results")
+    elif hasattr(csv_out, 'write'):
+        _write_csv(results, csv_out)
     else:
         logger.info('Opening CSV file %s for writing',
                     csv_out.split(os.sep)[-1])
         with open(csv_out, 'w') as f:
-            csv_file = csv.writer(f)
-            csv_file.writerow(['File or Folder', 'Red', 'Green', 'Blue'])
-            for r in results:
-                csv_line = [r['name'], r['red'], r['green'], r['blue']]
-                csv_file.writerow(csv_line)
-            f.close()
+            _write_csv(results, f)
+
+
+def _write_csv(results, f):
+    colorspace = _colorspace(results)
+    csv_file = csv.writer(f)
+    header = ['File or Folder', 'Red', 'Green', 'Blue']
+    if colorspace != 'srgb':
+        header += VALUE_NAMES[colorspace]
+    csv_file.writerow(header)
+    for r in results:
+        csv_line = [r['name'], r['red'], r['green'], r['blue']]
+        if colorspace != 'srgb':
+            csv_line += r['values']
+        csv_file.writerow(csv_line)
+
+
+def _colorspace(results):
+    """Return the colorspace of results, checking they all share it."""
+    colorspaces = set(r.get('colorspace', 'srgb') for r in results)
+    if len(colorspaces) > 1:
+        raise ValueError('results are in more than one colorspace')
+    return(colorspaces.pop())
 
 
 def results_load_csv(csv_in):
@@ -137,7 +165,8 @@ def results_load_csv(csv_in):
     'File or Folder', 'Red', 'Green', 'Blue' parses the file
     line by line skipping the header. Returns a list containing
     an list for each line in the csv. Does not do any input checks
-    other than converting the r, g, b colums to ints.
+    other than converting the r, g, b colums to ints. Colorspace value
+    columns written by results_save_csv are loaded as floats.
 
     Parameters
     ----------
@@ -149,20 +178,114 @@ def results_load_csv(csv_in):
             a list of imagecolor results
     """
     results = []
+    colorspace = 'srgb'
     logger.info('Opening CSV file %s for reading', csv_in.split(os.sep)[-1])
     with open(csv_in, "rt") as f:
         csv_file = csv.reader(f, delimiter=',')
         for row in csv_file:
             if row[0] in ['File', 'Folder', 'File or Folder']:
                 logger.info('Skipping header')
+                for name, value_names in VALUE_NAMES.items():
+                    if row[4:7] == value_names:
+                        colorspace = name
             else:
                 try:
                     dict_line = {'name': row[0],
                                  'red': int(row[1]),
                                  'green': int(row[2]),
                                  'blue': int(row[3])}
+                    if colorspace != 'srgb':
+                        dict_line['colorspace'] = colorspace
+                        dict_line['values'] = [float(v) for v in row[4:7]]
                     results.append(dict_line)
                 except Exception:
                     logger.exception('results_load_csv Exception',
                                      exc_info=True)
     return(results)
+
+
+def results_save_binary(results, bin_out):
+    """Create a binary file from a list of results.
+
+    A compact alternative to results_save_csv for large result sets.
+    The file starts with the bytes ICR1 and the number of results as
+    an unsigned 32 bit int. Each result is stored as the length of the
+    utf-8 encoded name as an unsigned 16 bit int, the name, then one
+    byte each for red, green and blue. All ints are big-endian.
+    Results averaged in a linear or lab colorspace start with ICR2
+    instead, have the index of the colorspace in COLORSPACES as a byte
+    after the count, and each result ends with its values as three
+    big-endian doubles.
+
+    Parameters
+    ----------
+        results : list
+            a list of imagecolor results
+        bin_out : str
+            the path to the file to be created or a binary file object
+    """
+    if len(results) == 0:
+        logger.error("Nothing in results")
+    elif hasattr(bin_out, 'write'):
+        _write_binary(results, bin_out)
+    else:
+        logger.info('Opening binary file %s for writing',
+                    bin_out.split(os.sep)[-1])
+        with open(bin_out, 'wb') as f:
+            _write_binary(results, f)
+
+
+def _write_binary(results, f):
+    colorspace = _colorspace(results)
+    if colorspace == 'srgb':
+        f.write(BINARY_MAGIC + struct.pack('>I', len(results)))
+    else:
+        f.write(BINARY_VALUES_MAGIC
+                + struct.pack('>IB', len(results),
+                              COLORSPACES.index(colorspace)))
+    for r in results:
+        name = str(r['name']).encode('utf-8')
+        f.write(struct.pack('>H', len(name)) + name
+                + struct.pack('>BBB', int(r['red']),
+                              int(r['green']), int(r['blue'])))
+        if colorspace != 'srgb':
+            f.write(struct.pack('>ddd', *r['values']))
+
+
+def results_load_binary(bin_in):
+    """Create a list of results from a binary file.
+
+    Accepts the path to a file created by results_save_binary.
+
+    Parameters
+    ----------
+        bin_in : str
+            the path to the file to be loaded
+    Returns
+    -------
+        list
+            a list of imagecolor results
+    """
+    results = []
+    logger.info('Opening binary file %s for reading',
+                bin_in.split(os.sep)[-1])
+    with open(bin_in, 'rb') as f:
+        magic = f.read(len(BINARY_MAGIC))
+        if magic not in [BINARY_MAGIC, BINARY_VALUES_MAGIC]:
+            raise ValueError('{} is not an imagecolor results file'
+                             .format(bin_in))
+        count, = struct.unpack('>I', f.read(4))
+        colorspace = 'srgb'
+        if magic == BINARY_VALUES_MAGIC:
+            colorspace = COLORSPACES[struct.unpack('>B', f.read(1))[0]]
+        for _ in range(count):
+            length, = struct.unpack('>H', f.read(2))
+            name = f.read(length).decode('utf-8')
+            red, green, blue = struct.unpack('>BBB', f.read(3))
+            result = {'name': name, 'red': red,
+                      'green': green, 'blue': blue}
+            if colorspace != 'srgb':
+                result['colorspace'] = colorspace
+                result['values'] = list(struct.unpack('>ddd', f.read(24)))
+            results.append(result)
+    return(results)
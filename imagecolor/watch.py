@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import imghdr
+import json
+import logging
+import os
+import struct
+import time
+
+from .average import IMAGE_TYPES
+from .average import _add_result
+from .average import _average_files
+from .average import _average_options
+from .average import _average_totals
+from .journal import read_records
+
+"""Copyright © 2017 Rhys Hansen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE."""
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) event flags
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+EVENT_HEADER = struct.Struct('iIII')
+# superseded state lines allowed before the state file is rewritten
+STATE_SLACK = 1000
+
+
+class Watcher(object):
+    """Keep the averages of a directory tree current as files change.
+
+    The tree is averaged once when the Watcher is created. After that
+    only created, modified and deleted images are averaged, and only
+    the directories containing them are updated, by adding and taking
+    away from running totals. Changes are found with inotify on Linux
+    and by polling file sizes and modification times elsewhere.
+
+    Each change is reported as a dictionary with the keys type ('file'
+    or 'directory'), path and result, the new imagecolor result or None
+    if the file was deleted or the directory no longer has images.
+    Changes are passed to callback and yielded by changes().
+
+    Parameters
+    ----------
+        root_dir : str
+            path to the directory to watch
+        callback : callable, optional
+            called with each change.
+        recursive : bool, optional
+            if True the average of a directory includes the images in
+            all of its subdirectories, so a change also updates every
+            ancestor up to root_dir. Otherwise directories are averaged
+            like nested_directory_average.
+        state : str, optional
+            path to a file the per file results are appended to after
+            each update. Files unchanged since the state was saved are
+            not averaged again when a new Watcher is created. State
+            saved with other average() options is discarded. The file
+            is rewritten without superseded lines once they pass
+            STATE_SLACK.
+        interval : float, optional
+            seconds between polls, or the longest wait for an inotify
+            event before checking if the Watcher was closed.
+        use_inotify : bool, optional
+            False to always poll. By default inotify is used if it is
+            available.
+        processes : int, optional
+            number of worker processes used to average changed files.
+        **kwargs
+            passed through to average().
+    """
+
+    def __init__(self, root_dir, callback=None, recursive=False, state=None,
+                 interval=2.0, use_inotify=None, processes=None, **kwargs):
+        self.root_dir = os.path.abspath(root_dir)
+        self.callback = callback
+        self.recursive = recursive
+        self.state = state
+        self.interval = interval
+        self.processes = processes
+        self.kwargs = kwargs
+        self.colorspace = kwargs.get('colorspace', 'srgb')
+        self.files = {}
+        self.ignored = {}
+        self.totals = {}
+        self._closed = False
+        self._waiting = False
+        self._inotify = None
+        self._watches = {}
+        self._state_file = None
+        self._state_lines = 0
+        if state is not None:
+            self._load_state()
+        if use_inotify is not False:
+            try:
+                self._inotify = _Inotify()
+            except OSError:
+                if use_inotify:
+                    raise
+                logger.info('inotify not available. Polling every %ss',
+                            interval, exc_info=True)
+            else:
+                self._watch_tree(self.root_dir)
+        self.poll(notify=False)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop watching. changes() returns after its current wait.
+
+        May be called from another thread, in which case inotify and
+        the state file are released when the current wait ends.
+        """
+        self._closed = True
+        if not self._waiting:
+            self._release()
+
+    def _release(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        if self._state_file is not None:
+            self._state_file.close()
+            self._state_file = None
+
+    def results(self):
+        """Return the current directory results sorted by path."""
+        results = []
+        for dir_path in sorted(self.totals):
+            result = self._directory_result(dir_path)
+            if result is not None:
+                results.append(result)
+        return(results)
+
+    def file_results(self):
+        """Return the current image results sorted by path."""
+        return([self.files[path][2] for path in sorted(self.files)
+                if self.files[path][2] is not None])
+
+    def changes(self):
+        """Yield changes as they happen until close() is called."""
+        while not self._closed:
+            for change in self._wait():
+                yield change
+
+    def _wait(self):
+        """Wait up to interval for changes and apply them."""
+        self._waiting = True
+        try:
+            if self._inotify is not None:
+                return(self._read_events())
+            time.sleep(self.interval)
+            return(self.poll())
+        finally:
+            self._waiting = False
+            if self._closed:
+                self._release()
+
+    def run(self):
+        """Watch until close() is called, passing changes to callback."""
+        for _ in self.changes():
+            pass
+
+    def poll(self, notify=True):
+        """Compare the tree with the known files and apply any changes.
+
+        Returns
+        -------
+            list
+                the changes made.
+        """
+        return(self._update_tree(self.root_dir, notify))
+
+    def _update_tree(self, top, notify=True):
+        snapshot = {}
+        for dir_path, _, filenames in os.walk(top):
+            for filename in filenames:
+                filepath = os.path.join(dir_path, filename)
+                stamp = _stamp(filepath)
+                if stamp is not None:
+                    snapshot[filepath] = stamp
+        changed = [path for path, stamp in snapshot.items()
+                   if stamp != self._known_stamp(path)]
+        removed = [path for path in list(self.files) + list(self.ignored)
+                   if _is_below(path, top) and path not in snapshot]
+        return(self._apply(changed, removed, notify))
+
+    def _known_stamp(self, path):
+        if path in self.files:
+            return(tuple(self.files[path][:2]))
+        return(self.ignored.get(path))
+
+    def _apply(self, changed, removed, notify=True):
+        """Update the files in changed and forget the files in removed."""
+        changes = []
+        records = []
+        dirs = set()
+        for path in removed:
+            if path in self.files or path in self.ignored:
+                records.append({'removed': path})
+            self.ignored.pop(path, None)
+            if path in self.files:
+                self._remove(path, dirs)
+                changes.append({'type': 'file', 'path': path,
+                                'result': None})
+        images = []
+        for path in changed:
+            stamp = _stamp(path)
+            if stamp is None:
+                continue
+            try:
+                is_image = imghdr.what(path) in IMAGE_TYPES
+            except OSError:
+                is_image = False
+            if is_image:
+                images.append((path, stamp))
+                self.ignored.pop(path, None)
+            else:
+                self.ignored[path] = stamp
+                records.append({'ignored': path, 'stamp': stamp})
+                if path in self.files:
+                    self._remove(path, dirs)
+                    changes.append({'type': 'file', 'path': path,
+                                    'result': None})
+        results = _average_files([path for path, _ in images],
+                                 self.processes, **self.kwargs)
+        for (path, stamp), result in zip(images, results):
+            if path in self.files:
+                self._remove(path, dirs)
+            self.files[path] = [stamp[0], stamp[1], result]
+            records.append({'file': path, 'stamp': stamp, 'result': result})
+            for dir_path in self._directories(path):
+                _add_result(self.totals.setdefault(dir_path, [0, 0, 0, 0]),
+                            result)
+                dirs.add(dir_path)
+            changes.append({'type': 'file', 'path': path, 'result': result})
+        for dir_path in sorted(dirs):
+            changes.append({'type': 'directory', 'path': dir_path,
+                            'result': self._directory_result(dir_path)})
+            if dir_path in self.totals and self.totals[dir_path][0] == 0:
+                del self.totals[dir_path]
+        if records and self.state is not None:
+            self._save_state(records)
+        if notify and self.callback is not None:
+            for change in changes:
+                self.callback(change)
+        return(changes)
+
+    def _remove(self, path, dirs):
+        result = self.files.pop(path)[2]
+        for dir_path in self._directories(path):
+            if dir_path in self.totals:
+                _add_result(self.totals[dir_path], result, sign=-1)
+                dirs.add(dir_path)
+
+    def _directories(self, path):
+        """Return the directories whose averages include path."""
+        dir_path = os.path.dirname(path)
+        dirs = [dir_path]
+        while self.recursive and dir_path != self.root_dir:
+            parent = os.path.dirname(dir_path)
+            if parent == dir_path:
+                break
+            dir_path = parent
+            dirs.append(dir_path)
+        return(dirs)
+
+    def _directory_result(self, dir_path):
+        totals = self.totals.get(dir_path)
+        if totals is None or totals[0] == 0:
+            return(None)
+        return(_average_totals(totals, os.path.basename(dir_path),
+                               self.colorspace))
+
+    def _watch_tree(self, top):
+        for dir_path, _, _ in os.walk(top):
+            try:
+                wd = self._inotify.add_watch(dir_path, WATCH_MASK)
+            except OSError:
+                logger.warning('Unable to watch %s', dir_path,
+                               exc_info=True)
+                continue
+            self._watches[wd] = dir_path
+
+    def _read_events(self):
+        changed = set()
+        removed = set()
+        changes = []
+        for wd, mask, name in self._inotify.read(self.interval):
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify queue overflowed. Rescanning')
+                changes.extend(self.poll())
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches:
+                continue
+            path = os.path.join(self._watches[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path)
+                    changes.extend(self._update_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    changes.extend(self._update_tree(path))
+            elif (mask & (IN_CLOSE_WRITE | IN_MOVED_TO)
+                  or mask & IN_CREATE and _is_hard_link(path)):
+                changed.add(path)
+                removed.discard(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                removed.add(path)
+                changed.discard(path)
+        if changed or removed:
+            changes.extend(self._apply(sorted(changed), sorted(removed)))
+        return(changes)
+
+    def _load_state(self):
+        """Load the files recorded in the state file.
+
+        The first line of the state file holds the average() options.
+        Each following line records a file result, an ignored file or a
+        removed path, later lines replacing earlier ones.
+        """
+        options = json.loads(json.dumps(_average_options(self.kwargs)))
+        records = read_records(self.state)
+        if records and records[0].get('options') != options:
+            logger.warning('Watch state %s was saved with other options. '
+                           'Averaging again', self.state)
+            records = []
+        if records:
+            logger.info('Loading watch state %s', self.state)
+        for record in records[1:]:
+            path = record.get('file', record.get('ignored',
+                                                 record.get('removed')))
+            self.files.pop(path, None)
+            self.ignored.pop(path, None)
+            if 'file' in record:
+                self.files[path] = record['stamp'] + [record['result']]
+            elif 'ignored' in record:
+                self.ignored[path] = tuple(record['stamp'])
+        for path, (_, _, result) in self.files.items():
+            for dir_path in self._directories(path):
+                _add_result(self.totals.setdefault(dir_path, [0, 0, 0, 0]),
+                            result)
+        self._state_lines = len(records)
+        if not records or self._state_slack() > STATE_SLACK:
+            self._rewrite_state()
+        else:
+            self._state_file = open(self.state, 'a')
+
+    def _save_state(self, records):
+        """Append records to the state file."""
+        for record in records:
+            self._state_file.write(json.dumps(record) + '\n')
+        self._state_file.flush()
+        self._state_lines += len(records)
+        if self._state_slack() > STATE_SLACK:
+            self._rewrite_state()
+
+    def _state_slack(self):
+        return(self._state_lines - 1 - len(self.files) - len(self.ignored))
+
+    def _rewrite_state(self):
+        """Write the state file again with only the current records."""
+        if self._state_file is not None:
+            self._state_file.close()
+        records = [{'options': _average_options(self.kwargs)}]
+        records.extend({'file': path, 'stamp': entry[:2], 'result': entry[2]}
+                       for path, entry in self.files.items())
+        records.extend({'ignored': path, 'stamp': stamp}
+                       for path, stamp in self.ignored.items())
+        temp = self.state + '.tmp'
+        with open(temp, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(temp, self.state)
+        self._state_lines = len(records)
+        self._state_file = open(self.state, 'a')
+
+
+def _stamp(path):
+    """Return the modification time and size of path or None."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return(None)
+    return((stat.st_mtime_ns, stat.st_size))
+
+
+def _is_hard_link(path):
+    """Return True if path has other links.
+
+    A new hard link is only reported by IN_CREATE, while other created
+    files are still being written and arrive again with IN_CLOSE_WRITE.
+    """
+    try:
+        return(os.stat(path).st_nlink > 1)
+    except OSError:
+        return(False)
+
+
+def _is_below(path, top):
+    return(path == top or path.startswith(top.rstrip(os.sep) + os.sep))
+
+
+class _Inotify(object):
+    """Minimal ctypes binding of the Linux inotify API."""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError('inotify is not supported on this platform')
+        self._ctypes = ctypes
+        self.fd = init(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = self._ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return(wd)
+
+    def read(self, timeout):
+        """Return (wd, mask, name) for events within timeout seconds."""
+        import select
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return([])
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return(events)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -41,6 +41,11 @@ setup(name='imagecolor',
       author_email='rhyshonline@gmail.com',
       license='MIT',
       packages=['imagecolor'],
+      entry_points={
+          'console_scripts': [
+              'imagecolor=imagecolor.cli:main',
+          ],
+        },
       install_requires=[
           'Pillow',
         ],
@@ -29,6 +29,68 @@ def test_average_from_tempfiles(tfile):
     assert result['blue'] == value
 
 
+def test_average_other_formats():
+    for fmt in ["bmp", "tiff"]:
+        imagebytes = BytesIO()
+        Image.new("RGB", (20, 20), "rgb(10, 20, 30)").save(imagebytes,
+                                                           format=fmt)
+        imagebytes.seek(0)
+        result = ic.average(imagebytes, name='test')
+        assert result['red'] == 10
+        assert result['green'] == 20
+        assert result['blue'] == 30
+
+
+def test_average_sampled_from_tempfiles(tfile):
+    for sampling in ['random', 'stride']:
+        result = ic.average(tfile.name, tolerance=1, sampling=sampling,
+                            seed=0)
+        assert result['red'] == 127
+        assert result['error'] <= 1
+
+
+def test_average_sampled_error_bound():
+    imagebytes = BytesIO()
+    im = Image.new("RGB", (300, 300))
+    im.putdata([(0, 0, 0) if i % 2 else (255, 255, 255)
+                for i in range(300 * 300)])
+    im.save(imagebytes, format="png")
+    imagebytes.seek(0)
+    result = ic.average(imagebytes, name='test', tolerance=4, seed=1)
+    assert result['error'] <= 4
+    assert abs(result['red'] - 127) <= 8
+
+
+def test_average_sampled_reduced_decode(caplog):
+    imagebytes = BytesIO()
+    gradient = Image.linear_gradient("L").resize((3000, 2000))
+    Image.merge("RGB", [gradient,
+                        gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+                        Image.effect_noise((3000, 2000), 10)]
+                ).save(imagebytes, format="jpeg", quality=90)
+    imagebytes.seek(0)
+    full = ic.average(imagebytes, name='test', downsample=False)
+    imagebytes.seek(0)
+    with caplog.at_level(logging.DEBUG, logger='imagecolor.average'):
+        sampled = ic.average(imagebytes, name='test', tolerance=2, seed=0)
+    # 1/8 of the image is decoded instead of 3000 x 2000
+    assert 'Decoding at 375 x 250' in caplog.text
+    assert sampled['error'] <= 2
+    for channel in ('red', 'green', 'blue'):
+        assert abs(sampled[channel] - full[channel]) <= 4
+
+
+def test_average_invalid_sampling(tfile):
+    with pytest.raises(ValueError):
+        ic.average(tfile.name, tolerance=1, sampling='blocks')
+
+
+def test_average_invalid_tolerance(tfile):
+    for tolerance in [0, -1, float('nan')]:
+        with pytest.raises(ValueError):
+            ic.average(tfile.name, tolerance=tolerance)
+
+
 def test_average_images_from_tempfiles(tdirectory):
     result = ic.average_images(tdirectory.name)
     for r in result:
@@ -84,3 +146,17 @@ def test_csv_save_and_load_from_tempfiles(tresults, tcsv):
     ic.results_save_csv(tresults, tcsv.name)
     results = ic.results_load_csv(tcsv.name)
     assert tresults == results
+
+
+def test_binary_save_and_load_from_tempfiles(tresults):
+    t_file = tempfile.NamedTemporaryFile(suffix='.bin')
+    ic.results_save_binary(tresults, t_file.name)
+    results = ic.results_load_binary(t_file.name)
+    assert tresults == results
+
+
+def test_directory_average_single_process(tdirectory):
+    result = ic.directory_average(tdirectory.name, processes=1)
+    assert result['red'] == 127
+    assert result['green'] == 127
+    assert result['blue'] == 127
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import os
+import sys
+import tempfile
+# installed
+from PIL import Image
+import pytest
+# local
+sys.path.append(os.path.split(os.path.split(__file__)[0])[0])
+import imagecolor as ic
+from imagecolor import cli
+
+
+def test_cli_csv_output(tdirectory):
+    t_file = tempfile.NamedTemporaryFile(suffix='.csv')
+    assert cli.main(['average-images', tdirectory.name, '-j', '1',
+                     '-o', t_file.name]) == 0
+    results = ic.results_load_csv(t_file.name)
+    assert sorted(r['red'] for r in results) == [0, 127, 255]
+
+
+def test_cli_binary_output(tdirectories):
+    t_file = tempfile.NamedTemporaryFile(suffix='.bin')
+    assert cli.main(['nested-directory-average', tdirectories.name,
+                     '-f', 'binary', '-o', t_file.name]) == 0
+    results = ic.results_load_binary(t_file.name)
+    assert sorted(r['blue'] for r in results) == [0, 127, 255]
+
+
+def test_cli_image_output_any_extension(tdirectory):
+    t_file = tempfile.NamedTemporaryFile(suffix='.dat')
+    assert cli.main(['average-images', tdirectory.name, '-j', '1',
+                     '-f', 'line', '-o', t_file.name]) == 0
+    with Image.open(t_file.name) as im:
+        assert im.format == 'PNG'
+        assert im.size == (3, 1)
+
+
+def test_cli_rectangle_needs_enough_results(tdirectory):
+    t_file = tempfile.NamedTemporaryFile(suffix='.png')
+    assert cli.main(['average-images', tdirectory.name, '-j', '1',
+                     '-f', 'rectangle', '-o', t_file.name]) == 1
+    assert os.path.getsize(t_file.name) == 0
+
+
+def test_cli_progress(tdirectory):
+    calls = []
+    args = cli.build_parser().parse_args(['directory-average',
+                                          tdirectory.name, '-j', '2'])
+    results = cli.run(args, callback=lambda done, total:
+                      calls.append((done, total)))
+    assert results[0]['red'] == 127
+    assert calls[-1] == (3, 3)
+
+
+def test_cli_requires_command():
+    with pytest.raises(SystemExit):
+        cli.main([])
+
+
+def test_cli_rejects_tolerance_zero(tdirectory):
+    with pytest.raises(SystemExit):
+        cli.main(['average-images', tdirectory.name, '-t', '0'])
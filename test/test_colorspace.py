@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+from io import BytesIO
+import os
+import sys
+import tempfile
+# installed
+from PIL import Image
+import pytest
+# local
+sys.path.append(os.path.split(os.path.split(__file__)[0])[0])
+import imagecolor as ic
+from imagecolor import colorspace
+
+
+@pytest.fixture(scope="module")
+def tcheckerboard():
+    imagebytes = BytesIO()
+    im = Image.new("RGB", (64, 64))
+    im.putdata([(255, 255, 255) if (x + x // 64) % 2 else (0, 0, 0)
+                for x in range(64 * 64)])
+    im.save(imagebytes, format="png")
+    return(imagebytes)
+
+
+def test_average_srgb_checkerboard(tcheckerboard):
+    tcheckerboard.seek(0)
+    result = ic.average(tcheckerboard, name='test', downsample=False)
+    assert result['red'] == 127
+    assert 'values' not in result
+
+
+def test_average_linear_checkerboard(tcheckerboard):
+    tcheckerboard.seek(0)
+    result = ic.average(tcheckerboard, name='test', colorspace='linear')
+    # half of the light is sRGB 188
+    assert result['red'] == 188
+    assert result['colorspace'] == 'linear'
+    assert result['values'][0] == pytest.approx(127.5)
+
+
+def test_average_lab_checkerboard(tcheckerboard):
+    tcheckerboard.seek(0)
+    result = ic.average(tcheckerboard, name='test', colorspace='lab')
+    assert result['values'][0] == pytest.approx(50, abs=0.5)
+    assert result['values'][1] == pytest.approx(0, abs=0.5)
+    assert result['red'] == result['green'] == result['blue']
+
+
+def test_average_lab_downsampled():
+    imagebytes = BytesIO()
+    gradient = Image.linear_gradient("L").resize((400, 300))
+    alpha = Image.new("L", (400, 300), 255)
+    alpha.paste(0, (0, 0, 100, 300))
+    Image.merge("RGBA", [gradient, gradient.rotate(90).resize((400, 300)),
+                         Image.new("L", (400, 300), 64), alpha]
+                ).save(imagebytes, format="png")
+    imagebytes.seek(0)
+    exact = ic.average(imagebytes, name='test', colorspace='lab',
+                       downsample=False)
+    imagebytes.seek(0)
+    result = ic.average(imagebytes, name='test', colorspace='lab')
+    assert result['values'] == pytest.approx(exact['values'], abs=1)
+
+
+def test_average_max_size_ignored_warning(tcheckerboard, caplog):
+    tcheckerboard.seek(0)
+    ic.average(tcheckerboard, name='test', tolerance=2, max_size=50)
+    assert 'max_size is ignored' in caplog.text
+
+
+def test_average_invalid_colorspace(tcheckerboard):
+    tcheckerboard.seek(0)
+    with pytest.raises(ValueError):
+        ic.average(tcheckerboard, name='test', colorspace='hsv')
+
+
+def test_round_trips():
+    for color in [(255, 0, 0), (0, 0, 0), (255, 255, 255), (128, 128, 128)]:
+        linear = [colorspace.SRGB_TO_LINEAR_LUT[v] for v in color]
+        assert colorspace.linear_to_srgb(linear) == color
+    assert colorspace.lab_to_srgb([100, 0, 0]) == (255, 255, 255)
+
+
+def test_directory_average_linear(tdirectory):
+    result = ic.directory_average(tdirectory.name, processes=1,
+                                  colorspace='linear')
+    expected = sum(colorspace.SRGB_TO_LINEAR_LUT[v]
+                   for v in [0, 127, 255]) / 3
+    assert result['values'][0] == pytest.approx(expected)
+    assert result['red'] == colorspace.linear_to_srgb([expected] * 3)[0]
+
+
+def test_save_and_load_values(tdirectories):
+    results = ic.nested_directory_average(tdirectories.name, processes=1,
+                                          colorspace='lab')
+    t_csv = tempfile.NamedTemporaryFile(suffix='.csv')
+    ic.results_save_csv(results, t_csv.name)
+    loaded = ic.results_load_csv(t_csv.name)
+    for r, l in zip(results, loaded):
+        assert l['values'] == pytest.approx(r['values'])
+    t_bin = tempfile.NamedTemporaryFile(suffix='.bin')
+    ic.results_save_binary(results, t_bin.name)
+    assert ic.results_load_binary(t_bin.name) == results
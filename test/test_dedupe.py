@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import os
+import shutil
+import sys
+import tempfile
+# installed
+from PIL import Image
+import pytest
+# local
+sys.path.append(os.path.split(os.path.split(__file__)[0])[0])
+import imagecolor as ic
+from imagecolor import dedupe
+
+
+@pytest.fixture(scope="module")
+def tduplicates():
+    t_directory = tempfile.TemporaryDirectory()
+    path = t_directory.name
+    for value in [0, 127]:
+        im = Image.new("RGB", (200, 200), "rgb({0}, {0}, {0})"
+                       .format(value))
+        im.save(os.path.join(path, '{}.png'.format(value)), format="png")
+    shutil.copy(os.path.join(path, '0.png'), os.path.join(path, 'copy.png'))
+    os.link(os.path.join(path, '127.png'), os.path.join(path, 'link.png'))
+    # large files whose first and last blocks match
+    large = os.urandom(3 * dedupe.PARTIAL_SIZE)
+    changed = (large[:dedupe.PARTIAL_SIZE] + b'\0' * dedupe.PARTIAL_SIZE
+               + large[2 * dedupe.PARTIAL_SIZE:])
+    for name, data in [('a.bin', large), ('b.bin', large),
+                       ('c.bin', changed)]:
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(data)
+    return(t_directory)
+
+
+def test_find_duplicates(tduplicates):
+    names = ['0.png', '127.png', 'copy.png', 'link.png',
+             'a.bin', 'b.bin', 'c.bin']
+    paths = [os.path.join(tduplicates.name, n) for n in names]
+    assert dedupe.find_duplicates(paths) == {2: 0, 3: 1, 5: 4}
+
+
+def test_average_images_dedupe(tduplicates, monkeypatch):
+    expected = ic.average_images(tduplicates.name, processes=1)
+    module = sys.modules['imagecolor.average']
+    calls = []
+    average = module.average
+
+    def counting_average(image, **kwargs):
+        calls.append(image)
+        return(average(image, **kwargs))
+    monkeypatch.setattr(module, 'average', counting_average)
+    results = ic.average_images(tduplicates.name, processes=1, dedupe=True)
+    assert len(calls) == 2
+    assert results == expected
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import json
+import os
+import sys
+import tempfile
+# installed
+from PIL import Image
+import pytest
+# local
+sys.path.append(os.path.split(os.path.split(__file__)[0])[0])
+import imagecolor as ic
+from imagecolor.journal import Journal
+
+
+def _recolor(directory, value):
+    for dir_path, _, filenames in os.walk(directory):
+        for filename in filenames:
+            im = Image.new("RGB", (200, 200), "rgb({0}, {0}, {0})"
+                           .format(value))
+            im.save(os.path.join(dir_path, filename), format="png")
+
+
+@pytest.mark.parametrize('colorspace', ['srgb', 'lab'])
+def test_journal_resume_skips_recorded_work(colorspace):
+    t_directory = tempfile.TemporaryDirectory()
+    for value in [0, 127, 240]:
+        subpath = os.path.join(t_directory.name, str(value))
+        os.mkdir(subpath)
+        for num in range(8):
+            im = Image.new("RGB", (20, 20), "rgb({0}, {1}, {2})"
+                           .format(value + num, value + 3 * num, 7 * num))
+            im.save(os.path.join(subpath, '{}.png'.format(num)),
+                    format="png")
+    t_journal = tempfile.NamedTemporaryFile(suffix='.journal')
+    journal = t_journal.name
+    expected = ic.nested_directory_average(t_directory.name, processes=1,
+                                           colorspace=colorspace)
+    first = ic.nested_directory_average(t_directory.name, processes=4,
+                                        journal=journal,
+                                        colorspace=colorspace)
+    assert first == expected
+    # a run resumed from the directory totals adds up exactly the same
+    assert ic.nested_directory_average(t_directory.name, processes=4,
+                                       journal=journal,
+                                       colorspace=colorspace) == expected
+    # drop one directory record and one file record to simulate a crash
+    with open(journal) as f:
+        records = [json.loads(l) for l in f]
+    dropped = [r for r in records if 'directory' in r][-1]
+    dropped_file = [r for r in records if 'file' in r][-1]
+    records.remove(dropped)
+    records.remove(dropped_file)
+    with open(journal, 'w') as f:
+        f.writelines(json.dumps(r) + '\n' for r in records)
+        f.write('{"file": "torn')
+    affected = set(os.path.basename(d) for d in [
+        dropped['directory'], os.path.dirname(dropped_file['file'])])
+    # recorded images are not averaged again so recoloring has no effect
+    _recolor(t_directory.name, 64)
+    resumed = ic.nested_directory_average(t_directory.name, processes=1,
+                                          journal=journal,
+                                          colorspace=colorspace)
+    assert [r['name'] for r in resumed] == [r['name'] for r in expected]
+    for r, e in zip(resumed, expected):
+        if r['name'] not in affected:
+            assert r == e
+    assert resumed != expected
+    # the torn line was cut off so every line of the journal is whole
+    # and a second resume repeats the first without averaging again
+    with open(journal) as f:
+        assert all(json.loads(l) for l in f)
+    _recolor(t_directory.name, 200)
+    assert ic.nested_directory_average(t_directory.name, processes=2,
+                                       journal=journal,
+                                       colorspace=colorspace) == resumed
+
+
+def test_journal_refuses_other_options(tdirectories):
+    t_journal = tempfile.NamedTemporaryFile(suffix='.journal')
+    ic.nested_directory_average(tdirectories.name, processes=1,
+                                journal=t_journal.name)
+    for kwargs in [{'colorspace': 'lab'}, {'max_size': 50},
+                   {'tolerance': 2}, {'alpha_threshold': 10}]:
+        with pytest.raises(ValueError):
+            ic.nested_directory_average(tdirectories.name, processes=1,
+                                        journal=t_journal.name, **kwargs)
+    results = ic.nested_directory_average(tdirectories.name, processes=1,
+                                          journal=t_journal.name,
+                                          max_size=100)
+    assert len(results) == 3
+
+
+def test_journal_directory_totals():
+    t_file = tempfile.NamedTemporaryFile(suffix='.journal')
+    d = os.path.join(tempfile.gettempdir(), 'dir')
+    a, b = os.path.join(d, 'a.png'), os.path.join(d, 'b.png')
+    with Journal(t_file.name) as journal:
+        journal.expect(d, [a, b])
+        journal.record_file(a, {'name': 'a.png', 'red': 10,
+                                'green': 20, 'blue': 30})
+        assert journal.directory_done(d) is None
+        journal.record_file(b, None)
+        assert journal.directory_done(d) == [1, 10, 20, 30]
+    reloaded = Journal(t_file.name)
+    assert reloaded.directory_done(d) == [1, 10, 20, 30]
+    assert reloaded.result(b) == (True, None)
+    reloaded.close()
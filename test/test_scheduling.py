@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+# installed
+from PIL import Image
+import pytest
+# local
+sys.path.append(os.path.split(os.path.split(__file__)[0])[0])
+import imagecolor as ic
+
+
+@pytest.fixture(scope="module")
+def tsizes():
+    t_directory = tempfile.TemporaryDirectory()
+    for size in [10, 300, 50, 120]:
+        im = Image.new("RGB", (size, size), "rgb(10, 20, 30)")
+        im.save(os.path.join(t_directory.name, '{}.png'.format(size)),
+                format="png")
+    return(t_directory)
+
+
+def _patch_average(monkeypatch, calls, slow=None, stall=time.sleep):
+    module = sys.modules['imagecolor.average']
+    average = module.average
+
+    def patched(image, **kwargs):
+        calls.append(os.path.basename(image))
+        if os.path.basename(image) == slow:
+            stall(5)
+        return(average(image, **kwargs))
+    monkeypatch.setattr(module, 'average', patched)
+
+
+def test_schedule_largest_first(tsizes, monkeypatch):
+    expected = ic.average_images(tsizes.name, processes=1)
+    for schedule in ['size', 'pixels']:
+        calls = []
+        _patch_average(monkeypatch, calls)
+        results = ic.average_images(tsizes.name, processes=1,
+                                    schedule=schedule)
+        assert calls == ['300.png', '120.png', '50.png', '10.png']
+        assert results == expected
+
+
+def test_timeout_skips_file(tsizes, monkeypatch):
+    skipped = []
+    _patch_average(monkeypatch, [], slow='120.png')
+    start = time.monotonic()
+    result = ic.directory_average(
+        tsizes.name, processes=1, timeout=0.2,
+        on_skip=lambda path, reason: skipped.append(os.path.basename(path)))
+    assert time.monotonic() - start < 4
+    assert skipped == ['120.png']
+    assert result['red'] == 10
+
+
+def _sleep_without_alarm(seconds):
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+    time.sleep(seconds)
+
+
+@pytest.mark.skipif(not hasattr(signal, 'pthread_sigmask'),
+                    reason='needs pthread_sigmask')
+@pytest.mark.parametrize('stall', [_sleep_without_alarm, os._exit])
+def test_timeout_replaces_stuck_worker(tsizes, monkeypatch, stall):
+    skipped = []
+    _patch_average(monkeypatch, [], slow='120.png', stall=stall)
+    start = time.monotonic()
+    results = ic.average_images(
+        tsizes.name, processes=2, timeout=0.2, schedule='size',
+        on_skip=lambda path, reason: skipped.append(os.path.basename(path)))
+    assert time.monotonic() - start < 4
+    assert skipped == ['120.png']
+    assert [r['red'] for r in results if r is not None] == [10] * 3
+
+
+def test_timeout_outside_main_thread(tsizes, monkeypatch):
+    skipped = []
+    _patch_average(monkeypatch, [], slow='120.png')
+    thread = threading.Thread(target=ic.average_images, args=(tsizes.name,),
+                              kwargs={'processes': 1, 'timeout': 0.2,
+                                      'on_skip': lambda path, reason:
+                                      skipped.append(reason)})
+    thread.start()
+    thread.join(4)
+    assert not thread.is_alive()
+    assert skipped == ['timed out after 0.2s']
+
+
+def test_decompression_bomb_skipped(tsizes, monkeypatch):
+    skipped = []
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 20000)
+    results = ic.average_images(
+        tsizes.name, processes=1,
+        on_skip=lambda path, reason: skipped.append(os.path.basename(path)))
+    assert skipped == ['300.png']
+    assert len([r for r in results if r is not None]) == 3
+
+
+def test_maxtasksperchild(tsizes):
+    results = ic.average_images(tsizes.name, processes=2,
+                                maxtasksperchild=1, schedule='size')
+    assert [r['blue'] for r in results] == [30] * 4
+
+
+def test_invalid_schedule(tsizes):
+    with pytest.raises(ValueError):
+        ic.average_images(tsizes.name, processes=1, schedule='name')
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+from io import BytesIO
+import os
+import sys
+import tempfile
+import threading
+import time
+# installed
+from PIL import Image
+import pytest
+# local
+sys.path.append(os.path.split(os.path.split(__file__)[0])[0])
+import imagecolor as ic
+
+
+def _save(path, value, size=20):
+    im = Image.new("RGB", (size, size), "rgb({0}, {0}, {0})".format(value))
+    im.save(path, format="png")
+
+
+@pytest.fixture()
+def ttree():
+    t_directory = tempfile.TemporaryDirectory()
+    for value in [0, 100]:
+        subpath = os.path.join(t_directory.name, str(value))
+        os.mkdir(subpath)
+        for num in range(2):
+            _save(os.path.join(subpath, '{}.png'.format(num)), value)
+    with open(os.path.join(t_directory.name, 'notes.txt'), 'w') as f:
+        f.write('not an image')
+    return(t_directory)
+
+
+def _directory_changes(changes):
+    return({os.path.basename(c['path']): c['result'] for c in changes
+            if c['type'] == 'directory'})
+
+
+def _watch_until(watcher, name, seconds=10):
+    """Collect changes until directory name has a result or seconds pass."""
+    deadline = threading.Timer(seconds, watcher.close)
+    deadline.start()
+    changes = []
+    try:
+        for change in watcher.changes():
+            changes.append(change)
+            if _directory_changes(changes).get(name):
+                break
+    finally:
+        deadline.cancel()
+    return(changes)
+
+
+def test_watch_poll_updates(ttree):
+    root = ttree.name
+    seen = []
+    with ic.Watcher(root, callback=seen.append, use_inotify=False,
+                    processes=1) as watcher:
+        assert watcher.results() == sorted(
+            ic.nested_directory_average(root, processes=1),
+            key=lambda r: r['name'])
+        assert watcher.poll() == []
+        _save(os.path.join(root, '0', '2.png'), 60, size=30)
+        changes = watcher.poll()
+        assert _directory_changes(changes)['0']['red'] == 20
+        os.remove(os.path.join(root, '100', '0.png'))
+        os.remove(os.path.join(root, '100', '1.png'))
+        changes = watcher.poll()
+        assert _directory_changes(changes) == {'100': None}
+    assert len(seen) == 2 + 3
+    assert [r['name'] for r in watcher.results()] == ['0']
+
+
+def test_watch_recursive_and_state(ttree):
+    root = ttree.name
+    state = os.path.join(tempfile.mkdtemp(), 'state.json')
+    with ic.Watcher(root, recursive=True, state=state, use_inotify=False,
+                    processes=1) as watcher:
+        results = {r['name']: r['red'] for r in watcher.results()}
+        assert results[os.path.basename(root)] == 50
+        _save(os.path.join(root, '100', '2.png'), 250, size=30)
+        changes = _directory_changes(watcher.poll())
+        assert changes[os.path.basename(root)]['red'] == 90
+        assert changes['100']['red'] == 150
+    with open(state) as f:
+        # options, five images, notes.txt and the appended change
+        assert len(f.readlines()) == 1 + 5 + 1
+    with ic.Watcher(root, recursive=True, state=state,
+                    use_inotify=False) as reloaded:
+        assert reloaded.results() == watcher.results()
+        assert reloaded.poll() == []
+    with ic.Watcher(root, recursive=True, state=state, use_inotify=False,
+                    processes=1, colorspace='linear') as other:
+        assert all(r['colorspace'] == 'linear' for r in other.results())
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_watch_inotify(ttree):
+    root = ttree.name
+    with ic.Watcher(root, interval=0.1, use_inotify=True,
+                    processes=1) as watcher:
+        os.mkdir(os.path.join(root, 'new'))
+        _save(os.path.join(root, 'new', '0.png'), 30)
+        changes = _watch_until(watcher, 'new')
+        assert _directory_changes(changes)['new']['red'] == 30
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_watch_inotify_hard_link(ttree):
+    root = ttree.name
+    with ic.Watcher(root, interval=0.1, use_inotify=True,
+                    processes=1) as watcher:
+        os.link(os.path.join(root, '100', '0.png'),
+                os.path.join(root, '0', 'linked.png'))
+        changes = _watch_until(watcher, '0')
+        assert _directory_changes(changes)['0']['red'] == 33
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+def test_watch_inotify_waits_for_close_write(ttree):
+    root = ttree.name
+    path = os.path.join(root, '0', 'new.png')
+    data = BytesIO()
+    Image.new("RGB", (200, 200), "rgb(90, 90, 90)").save(data, format="png")
+    data = data.getvalue()
+
+    def write_in_chunks():
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+            f.flush()
+            time.sleep(0.5)
+            f.write(data[len(data) // 2:])
+    with ic.Watcher(root, interval=0.1, use_inotify=True,
+                    processes=1) as watcher:
+        threading.Thread(target=write_in_chunks).start()
+        changes = _watch_until(watcher, '0')
+    assert [c['result']['red'] for c in changes if c['path'] == path] == [90]
+    assert _directory_changes(changes)['0']['red'] == 30
+
+
+def test_watch_close_from_another_thread(ttree):
+    watcher = ic.Watcher(ttree.name, interval=0.1, processes=1)
+    threading.Timer(0.2, watcher.close).start()
+    assert _watch_until(watcher, 'new', seconds=5) == []
+    assert watcher._inotify is None
+
+
+def test_watch_state_rewritten(ttree, monkeypatch):
+    monkeypatch.setattr(sys.modules['imagecolor.watch'], 'STATE_SLACK', 1)
+    root = ttree.name
+    state = os.path.join(tempfile.mkdtemp(), 'state.json')
+    with ic.Watcher(root, state=state, use_inotify=False,
+                    processes=1) as watcher:
+        for value in [10, 20, 30]:
+            _save(os.path.join(root, '0', '0.png'), value, size=10 + value)
+            watcher.poll()
+    with open(state) as f:
+        assert len(f.readlines()) <= 1 + 5 + 2
+    with ic.Watcher(root, state=state, use_inotify=False) as reloaded:
+        assert reloaded.results() == watcher.results()